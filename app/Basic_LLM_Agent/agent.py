@@ -1,4 +1,7 @@
+import asyncio
 import json
+import os
+import sys
 from google.adk.agents import LlmAgent
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
@@ -6,6 +9,14 @@ from google.adk.tools import google_search
 from google.genai import types
 from pydantic import BaseModel, Field
 
+# the shared modules live in app/, which adk web puts on sys.path but a direct script run does not
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _APP_DIR not in sys.path:
+    sys.path.append(_APP_DIR)
+
+from common import configure_event_loop, get_model
+from semantic_cache import SemanticCache
+
 
 APP_NAME = "Basic LLM Agent"
 USER_ID = "test_user_001"
@@ -16,7 +27,7 @@ model_name = "gemini-2.0-flash"
 # define the agents
 
 root_agent = LlmAgent(
-    model=model_name,
+    model=get_model(model_name),
     name = "root_agent",
     description="Ansers users questions and provides precise and accurate answers.",
     instruction=""" You are an agent that answers any question asked by the user.
@@ -34,15 +45,32 @@ session_service = InMemorySessionService()
 # Create separate sessions for clarity, though not strictly necessary if context is managed
 session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
 
+configure_event_loop()
 runner = Runner(
     agent = root_agent,
     app_name= APP_NAME,
     session_service = session_service
     )
 
+# answers to semantically identical questions are served without calling the LLM;
+# they come from google_search, so they expire after a day instead of surviving every restart
+response_cache = SemanticCache(
+    threshold=0.92,
+    max_entries=1024,
+    persist_path=".cache/agent_embeddings.faiss",
+    ttl_seconds=24 * 3600,
+)
+
 async def run_agent(input_text: str):
     """Sends query to the agent and returns the response."""
     print(f"User query: {input_text}")
+    # embedding and index work runs in a worker thread so the event loop is not blocked
+    query_embedding = await asyncio.to_thread(response_cache.embed, input_text)
+    cached_response = await asyncio.to_thread(response_cache.lookup, query_embedding)
+    if cached_response is not None:
+        print(f"<<< Agent '{root_agent.name}', Cached response: {cached_response}")
+        return cached_response
+
     content = types.Content(role = "user", parts=[types.Part(text=input_text)])
     final_response_content = "No final response received."
 
@@ -53,6 +81,7 @@ async def run_agent(input_text: str):
         if event.is_final_response() and event.content and event.content.parts:
             # For output_schema, the content is the JSON string itself
             final_response_content = event.content.parts[0].text
+            await asyncio.to_thread(response_cache.insert, query_embedding, final_response_content)
             break
 
     print(f"<<< Agent '{root_agent.name}', Response: {final_response_content}")
@@ -60,8 +89,9 @@ async def run_agent(input_text: str):
 
 
 async def main():
-    input_text = input("Enter your question: ")
-    print(run_agent(input_text))
+    # read stdin in a worker thread so the event loop is not blocked while waiting for input
+    input_text = await asyncio.to_thread(input, "Enter your question: ")
+    print(await run_agent(input_text))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
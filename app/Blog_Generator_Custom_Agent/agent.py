@@ -1,15 +1,29 @@
+import asyncio
+import json
 import logging
-from typing import AsyncGenerator
+import os
+import re
+import sys
+import time
+from typing import AsyncGenerator, Callable, Optional
 from typing_extensions import override
 
-from google.adk.agents import BaseAgent, LlmAgent, SequentialAgent, LoopAgent
+from google.adk.agents import BaseAgent, LlmAgent, LoopAgent
 from google.adk.agents.invocation_context import InvocationContext
 from google.genai import types
 from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
-from google.adk.events import Event
+from google.adk.events import Event, EventActions
 from google.adk.tools import google_search
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+# the shared modules live in app/, which adk web puts on sys.path but a direct script run does not
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _APP_DIR not in sys.path:
+    sys.path.append(_APP_DIR)
+
+from common import BatchProcessor, SessionLocks, configure_event_loop, get_model, pump_events
+from semantic_cache import SemanticCache
 
 
 APP_NAME = "Custom Blog Generator Agent"
@@ -18,6 +32,27 @@ SESSION_ID = "test_session_004"
 model_name = "gemini-2.0-flash"
 session_service= InMemorySessionService()
 
+# intermediate responses are yielded in batches of up to STREAM_FLUSH_SIZE texts or every STREAM_FLUSH_INTERVAL seconds
+STREAM_FLUSH_SIZE = 16
+STREAM_FLUSH_INTERVAL = 0.05
+
+REVIEW_VERDICT_PATTERN = re.compile(r'\{\s*"status"\s*:\s*"[^"]*"\s*\}')
+
+# generated HTML keyed on the blog topic. Answers hit 3 times are copied to a second LRU cache, which only
+# frequently used answers enter, so a burst of one-off topics cannot evict them
+blog_cache = SemanticCache(
+    threshold=0.9,
+    long_term=SemanticCache(threshold=0.9),
+    promote_after=3,
+)
+# session state flag that stops a run from scheduling a prefetch. It is set on the runs started by
+# _prefetch_related, so they do not recurse, and by call_agent, whose Runner.run loop ends with the run
+NO_PREFETCH_STATE_KEY = "no_prefetch"
+# number of related topics generated in the background after each fresh run, 0 (the default) disables it
+PREFETCH_TOPICS = int(os.environ.get("BLOG_PREFETCH_TOPICS", "0"))
+# strong references to the running prefetch tasks, so they are not garbage collected
+_prefetch_tasks: set = set()
+
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -38,11 +73,14 @@ class BlogGeneratorAgent(BaseAgent):
     review_agent: LlmAgent
 
     loop_agent: LoopAgent
-    sequential_agent: SequentialAgent
-    second_loop_agent: LoopAgent
+    max_review_iterations: int
+    prefetch_topics: int
     # model_config allows setting Pydantic configurations if needed, e.g., arbitrary_types_allowed
     model_config = {"arbitrary_types_allowed": True}
 
+    # one run at a time per session, since the workflow reads and writes the shared session state
+    _invoke_locks: SessionLocks = PrivateAttr(default_factory=SessionLocks)
+
     def __init__(self,
         name: str,
         title_generator: LlmAgent,
@@ -51,6 +89,8 @@ class BlogGeneratorAgent(BaseAgent):
         seo_optimizer: LlmAgent,
         html_generator: LlmAgent,
         review_agent: LlmAgent,
+        max_review_iterations: int = 3,
+        prefetch_topics: int = 0,
         ):
         """
         Initialize the BlogGeneratorAgent with the provided agents.
@@ -62,27 +102,19 @@ class BlogGeneratorAgent(BaseAgent):
             seo_optimizer (LlmAgent): Agent for optimizing SEO.
             html_generator (LlmAgent): Agent for generating HTML code.
             review_agent (LlmAgent): Agent for reviewing the final output.
+            max_review_iterations (int): Maximum HTML generation and review rounds, stopping early once the review passes.
+            prefetch_topics (int): Number of related topics generated in the background after a run. 0, the default, disables prefetching.
         """
 
-        sequential_agent = SequentialAgent(
-            name="Blog_Title_and_Structure_Generation",
-            description="A sequrntial agent to Generate a blog title and structure",
-            sub_agents=[title_generator, structure_generator, ],
-        )
-
         loop_agent = LoopAgent(
             name="Blog_Generation_and_SEO_Optimization",
             description="Loop agent for blog generation and SEO optimization.",
             sub_agents=[blog_generator,seo_optimizer,],
             max_iterations=3,
         )
-        second_loop_agent = LoopAgent(
-            name="Blog_HTML_Generation_and_Review",
-            description="A sequrntial agent to Generate a blog HTML and review it",
-            sub_agents=[html_generator, review_agent,],
-            max_iterations=3,
-        )
-        sub_agents = [sequential_agent, loop_agent, second_loop_agent]
+        # title and structure only depend on the topic, so they run concurrently in _run_async_impl
+        # html generation and review loop in _run_async_impl so it can stop as soon as the review passes
+        sub_agents = [title_generator, structure_generator, loop_agent, html_generator, review_agent]
 
         super().__init__(
             name=name,
@@ -92,9 +124,9 @@ class BlogGeneratorAgent(BaseAgent):
             seo_optimizer=seo_optimizer,
             html_generator=html_generator,
             review_agent=review_agent,
-            sequential_agent=sequential_agent,
             loop_agent=loop_agent,
-            second_loop_agent=second_loop_agent,
+            max_review_iterations=max_review_iterations,
+            prefetch_topics=prefetch_topics,
             sub_agents=sub_agents
         )
 
@@ -108,50 +140,146 @@ class BlogGeneratorAgent(BaseAgent):
             Event: The generated events during the run.
         """
 
-        logger.info("Starting blog generation process...")
-
-        # Step 1: Generate a blog title and structure using the sequential_agent
-        async for event in self.sequential_agent.run_async(ctx):
-            logger.info(f"Event from sequential_agent: {event}")
-            yield event
-
-        if "blog_structure" not in ctx.session.state or not ctx.session.state["blog_structure"]:
-            logger.error("No blog structure generated.")
+        async with self._invoke_locks.hold(ctx.session.id):
+            blog_topic = _get_blog_topic(ctx)
+            # embedding and index work runs in a worker thread so other sessions on this loop are not stalled
+            topic_embedding = await asyncio.to_thread(blog_cache.embed, blog_topic) if blog_topic else None
+            cached_html = (
+                await asyncio.to_thread(blog_cache.lookup, topic_embedding) if topic_embedding is not None else None
+            )
+            if cached_html is not None:
+                logger.info(f"Serving cached blog post for topic: {blog_topic}")
+                yield Event(
+                    invocation_id=ctx.invocation_id,
+                    author=self.name,
+                    branch=ctx.branch,
+                    content=types.Content(role="model", parts=[types.Part(text=cached_html)]),
+                    actions=EventActions(state_delta={"html_code": cached_html}),
+                )
+                return
+
+            logger.info("Starting blog generation process...")
+
+            # Step 1: Generate a blog title and structure concurrently, yielding events as they arrive
+            async for event in pump_events(
+                self.title_generator.run_async(ctx),
+                self.structure_generator.run_async(ctx),
+            ):
+                logger.info(f"Event from {event.author}: {event}")
+                yield event
+
+            if "blog_structure" not in ctx.session.state or not ctx.session.state["blog_structure"]:
+                logger.error("No blog structure generated.")
+                return
+
+            logger.info(f"Generated blog structure: {ctx.session.state['blog_structure']}")
+
+
+
+            # Step 2: Generate blog content and optimize for SEO using the loop_agent
+            async for event in self.loop_agent.run_async(ctx):
+                logger.info(f"Event from loop_agent: {event}")
+                yield event
+
+            logger.info("Blog content generation and SEO optimization completed.")
+
+            if "blog_content" not in ctx.session.state or not ctx.session.state["blog_content"]:
+                logger.error("No blog content generated.")
+                return
+            logger.info(f"Generated blog content: {ctx.session.state['blog_content']}")
+
+
+
+            # Step 3: Generate HTML code and review it, until the review passes or max_review_iterations is reached
+            for iteration in range(self.max_review_iterations):
+                async for event in self.html_generator.run_async(ctx):
+                    logger.info(f"Event from html_generator: {event}")
+                    yield event
+                async for event in self.review_agent.run_async(ctx):
+                    logger.info(f"Event from review_agent: {event}")
+                    yield event
+
+                if _is_clean(ctx.session.state.get("review_result")):
+                    logger.info(f"HTML review passed after {iteration + 1} iteration(s).")
+                    break
+            logger.info("HTML generation and review completed.")
+            if "html_code" not in ctx.session.state or not ctx.session.state["html_code"]:
+                logger.error("No HTML code generated.")
+                return
+            logger.info(f"Generated HTML code: {ctx.session.state['html_code']}")
+
+            if topic_embedding is not None:
+                await asyncio.to_thread(blog_cache.insert, topic_embedding, ctx.session.state["html_code"])
+                if self.prefetch_topics and not ctx.session.state.get(NO_PREFETCH_STATE_KEY):
+                    # runs on the serving loop, e.g. adk web, after this invocation has finished
+                    task = asyncio.create_task(_prefetch_related(blog_topic, self.prefetch_topics))
+                    _prefetch_tasks.add(task)
+                    task.add_done_callback(_prefetch_tasks.discard)
+
+
+def _get_blog_topic(ctx: InvocationContext) -> Optional[str]:
+    """Returns the blog topic from session state, or else from the user message."""
+    blog_topic = ctx.session.state.get("blog_topic")
+    if blog_topic:
+        return blog_topic
+    if ctx.user_content and ctx.user_content.parts and ctx.user_content.parts[0].text:
+        return ctx.user_content.parts[0].text.removeprefix("Generate a blog post about:").strip()
+    return None
+
+
+async def _prefetch_related(blog_topic: str, count: int):
+    """
+    Generate blog posts for topics related to blog_topic in the background, so follow-up requests hit blog_cache.
+    Args:
+        blog_topic (str): The topic that was just generated.
+        count (int): Number of related topics to prefetch.
+    """
+    try:
+        response = await get_model(model_name).api_client.aio.models.generate_content(
+            model=model_name,
+            contents=f"List {count} blog topics closely related to: {blog_topic}. "
+                     "Answer with one topic per line and nothing else.",
+        )
+        related_topics = [line.strip(" -*0123456789.").strip() for line in (response.text or "").splitlines()]
+        related_topics = [topic for topic in related_topics if topic][:count]
+        # topics already answered by the cache are not generated again
+        related_topics = [
+            topic for topic in related_topics
+            if not await asyncio.to_thread(lambda: blog_cache.contains(blog_cache.embed(topic)))
+        ]
+        if not related_topics:
             return
 
-        logger.info(f"Generated blog structure: {ctx.session.state['blog_structure']}")
-
-
-
-        # Step 2: Generate blog content and optimize for SEO using the loop_agent
-        async for event in self.loop_agent.run_async(ctx):
-            logger.info(f"Event from loop_agent: {event}")
-            yield event
-
-        logger.info("Blog content generation and SEO optimization completed.")
-
-        if "blog_content" not in ctx.session.state or not ctx.session.state["blog_content"]:
-            logger.error("No blog content generated.")
-            return
-        logger.info(f"Generated blog content: {ctx.session.state['blog_content']}")
+        logger.info(f"Prefetching related blog topics: {related_topics}")
+        await call_agent_batch(related_topics, max_concurrency=count, extra_state={NO_PREFETCH_STATE_KEY: True})
+    except Exception as error:
+        logger.error(f"Prefetching topics related to '{blog_topic}' failed: {error}")
 
 
+def _is_clean(review_result) -> bool:
+    """
+    Check whether the review agent found nothing left to fix.
+    Args:
+        review_result: The review agent output stored under the key "review_result".
+    Returns:
+        bool: True if the review carries an "ok" verdict or reports no errors.
+    """
+    if not review_result:
+        return False
 
-        # Step 3: Generate HTML code and review it using the second_loop_agent
-        async for event in self.second_loop_agent.run_async(ctx):
-            logger.info(f"Event from second_loop_agent: {event}")
-            yield event
-        logger.info("HTML generation and review completed.")
-        if "html_code" not in ctx.session.state or not ctx.session.state["html_code"]:
-            logger.error("No HTML code generated.")
-            return
-        logger.info(f"Generated HTML code: {ctx.session.state['html_code']}")
+    verdicts = REVIEW_VERDICT_PATTERN.findall(review_result)
+    if verdicts:
+        try:
+            return json.loads(verdicts[-1])["status"].lower() == "ok"
+        except json.JSONDecodeError:
+            pass
+    return "no errors" in review_result.lower()
 
 
 # Let;s define  the individual agents for title generation, structure generation, blog content generation, SEO optimization, HTML generation, and review.
 
 title_generator = LlmAgent(
-    model=model_name,
+    model=get_model(model_name),
     name="Title_Generator",
     description="Generates a catchy, SEO firendly title for the blog post.",
     instruction= """
@@ -162,13 +290,12 @@ title_generator = LlmAgent(
 )
 
 structure_generator = LlmAgent(
-    model=model_name,
+    model=get_model(model_name),
     name="Structure_Generator",
     description="Generates a detailed structure for the blog post.",
     instruction= """
     You are a structure generator for a blog post.
-    1. You take the blog title from  the key "blog_title"
-    2. You take the blog topic from the key "blog_topic"
+    1. You take the blog topic from the key "blog_topic"
     2. You use google_search tool to search for the topic and generate a detailed structure for the blog post.
     """,
     output_key="blog_structure",
@@ -176,7 +303,7 @@ structure_generator = LlmAgent(
 )
 
 blog_generator = LlmAgent(
-    model=model_name,
+    model=get_model(model_name),
     name="Blog_Generator",
     description="Generates a detailed blog post based on the given blog title and structure.",
     instruction= """
@@ -192,7 +319,7 @@ blog_generator = LlmAgent(
 )
 
 seo_optimizer = LlmAgent(
-    model=model_name,
+    model=get_model(model_name),
     name="SEO_Optimizer",
     description="Optimizes the blog post for SEO.",
     instruction= """
@@ -204,7 +331,7 @@ seo_optimizer = LlmAgent(
 )
 
 html_generator = LlmAgent(
-    model=model_name,
+    model=get_model(model_name),
     name="HTML_Generator",
     description="Generates HTML code for the blog post.",
     instruction= """
@@ -216,7 +343,7 @@ html_generator = LlmAgent(
 )
 
 review_agent = LlmAgent(
-    model=model_name,
+    model=get_model(model_name),
     name="Review_Agent",
     description="Reviews the HTML code for errors and suggestions.",
     instruction= """
@@ -225,6 +352,8 @@ review_agent = LlmAgent(
     2. You review the HTML code for errors and suggestions.
     3. based on the review, you provide a detailed feedback on how to improve the HTML code.
     4. Based on your review and feedback, you modify the HTML code to make it better.
+    5. You end your response with a line containing only the verdict {"status": "ok"} if the HTML code has no errors,
+    or {"status": "needs_changes"} otherwise.
     """,
     output_key="review_result",
 )
@@ -237,36 +366,41 @@ root_agent = BlogGeneratorAgent(
     seo_optimizer=seo_optimizer,
     html_generator=html_generator,
     review_agent=review_agent,
+    prefetch_topics=PREFETCH_TOPICS,
 )
 
 # --- Run the agent ---
 
-session = session_service.create_session(
+_SESSION = session_service.create_session(
     app_name=APP_NAME,
     user_id=USER_ID,
     session_id=SESSION_ID,
 )
+configure_event_loop()
 runner = Runner(
     app_name=APP_NAME,
     agent=root_agent,
     session_service=session_service,
 )
 
+def get_session():
+    """Returns the session handle created at import, instead of looking it up on every call."""
+    return _SESSION
+
 def call_agent(blog_topic: str):
     """
     Call the agent with the given blog topic.
     Args:
         blog_topic (str): The topic for the blog post.
     """
-    current_session = session_service.get_session(
-        app_name=APP_NAME,
-        user_id=USER_ID,
-        session_id=SESSION_ID,
+    current_session = get_session()
+
+    # session services hand out copies, so state is changed through an event rather than by mutating the handle.
+    # Runner.run cancels pending tasks when its loop exits, so runs started here never schedule a prefetch
+    session_service.append_event(
+        current_session,
+        Event(author="user", actions=EventActions(state_delta={"blog_topic": blog_topic, NO_PREFETCH_STATE_KEY: True})),
     )
-    if not current_session:
-        logger.error("Session not found.")
-        return
-    current_session.state["blog_topic"] = blog_topic
 
     logger.info(f"Blog topic set to: {blog_topic}")
 
@@ -277,24 +411,89 @@ def call_agent(blog_topic: str):
         new_message=content,
     )
 
+    buf: list[str] = []
+    last_flush = time.monotonic()
+    # every stage ends with a final response, so the stream is drained and only the last one is reported as final;
+    # the others are held back and streamed as intermediate responses in order
+    finally_response_content = None
+
     for event in events:
-        if event.content and event.content.parts:
-            yield f"Intermediate response: {event.content.parts[0].text}"
+        if not (event.content and event.content.parts and event.content.parts[0].text):
+            continue
 
-        if event.is_final_response() and event.content and event.content.parts:
+        if finally_response_content is not None:
+            buf.append(finally_response_content)
+            finally_response_content = None
+        if event.is_final_response():
             # For output_schema, the content is the JSON string itself
             finally_response_content = event.content.parts[0].text
-            yield f"Final response: {finally_response_content}"
-            break
+        else:
+            buf.append(event.content.parts[0].text)
+
+        if buf and (len(buf) >= STREAM_FLUSH_SIZE or time.monotonic() - last_flush > STREAM_FLUSH_INTERVAL):
+            yield "Intermediate response: " + "\n".join(buf)
+            buf = []
+            last_flush = time.monotonic()
+
+    if buf:
+        yield "Intermediate response: " + "\n".join(buf)
+    yield f"Final response: {finally_response_content or 'No final response received.'}"
 
+    # the runner works on its own copy of the session, so the final state has to be read back from the service
     final_session = session_service.get_session(app_name=APP_NAME,
                                                 user_id=USER_ID,
                                                 session_id=SESSION_ID)
     print("Final Session State:")
-    import json
     print(json.dumps(final_session.state, indent=2))
     print("-------------------------------\n")
 
+
+async def call_agent_batch(
+    blog_topics: list[str],
+    max_concurrency: int = 10,
+    rate_limit: int = 100,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    extra_state: Optional[dict] = None,
+) -> list:
+    """
+    Generate blog posts for several topics at once.
+    Every topic runs the full pipeline in its own session, so topics advance through the stages
+    concurrently while each topic keeps its own stage order.
+    Args:
+        blog_topics (list[str]): The topics for the blog posts.
+        max_concurrency (int): Maximum number of topics generated at the same time.
+        rate_limit (int): Maximum number of topics started per minute.
+        progress_callback (Optional[Callable[[int, int], None]]): Called with (done, total) after each topic.
+        extra_state (Optional[dict]): Additional initial session state for every topic.
+    Returns:
+        list: The generated HTML code for each topic, in order. A topic that failed holds the exception,
+            and one that produced no HTML holds None.
+    """
+    async def _generate(blog_topic: str) -> Optional[str]:
+        topic_session = session_service.create_session(
+            app_name=APP_NAME,
+            user_id=USER_ID,
+            state={**(extra_state or {}), "blog_topic": blog_topic},
+        )
+        content = types.Content(role="user", parts=[types.Part(text=f"Generate a blog post about: {blog_topic}")])
+        try:
+            async for _ in runner.run_async(user_id=USER_ID, session_id=topic_session.id, new_message=content):
+                pass
+
+            final_session = session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=topic_session.id)
+            return final_session.state.get("html_code")
+        finally:
+            # the session only lives for this topic, so it is dropped instead of piling up in the service
+            session_service.delete_session(app_name=APP_NAME, user_id=USER_ID, session_id=topic_session.id)
+
+    processor = BatchProcessor(
+        max_concurrency=max_concurrency,
+        rate_limit=rate_limit,
+        progress_callback=progress_callback,
+    )
+    return await processor.run(blog_topics, _generate)
+
 if __name__ == "__main__":
     query = input("Enter your question: ")
-    call_agent(query)
\ No newline at end of file
+    for response in call_agent(query):
+        print(response)
\ No newline at end of file
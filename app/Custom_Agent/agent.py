@@ -1,4 +1,6 @@
 import logging
+import os
+import sys
 from typing import AsyncGenerator
 from typing_extensions import override
 
@@ -7,8 +9,15 @@ from google.adk.agents.invocation_context import InvocationContext
 from google.genai import types
 from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
-from google.adk.events import Event
-from pydantic import BaseModel, Field
+from google.adk.events import Event, EventActions
+from pydantic import BaseModel, Field, PrivateAttr
+
+# the shared modules live in app/, which adk web puts on sys.path but a direct script run does not
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _APP_DIR not in sys.path:
+    sys.path.append(_APP_DIR)
+
+from common import SessionLocks, get_model
 
 
 APP_NAME = "Basic LLM Agent"
@@ -38,10 +47,14 @@ class StoryFlowAgent(BaseAgent):
 
     loop_agent: LoopAgent
     sequential_agent: SequentialAgent
+    min_critique_words: int
     
     # model_config allows setting Pydantic configurations if needed, e.g., arbitrary_types_allowed
     model_config = {"arbitrary_types_allowed": True}
 
+    # one run at a time per session, since the workflow reads and writes the shared session state
+    _invoke_locks: SessionLocks = PrivateAttr(default_factory=SessionLocks)
+
     def __init__(self, 
         name: str,
         story_generator: LlmAgent,
@@ -49,6 +62,7 @@ class StoryFlowAgent(BaseAgent):
         reviser: LlmAgent,
         grammar_checker: LlmAgent,
         tone_checker: LlmAgent,         
+        min_critique_words: int = 120,
         ):
         """
         Initialize the StoryFlowAgent with the provided agents.
@@ -58,6 +72,7 @@ class StoryFlowAgent(BaseAgent):
             reviser (LlmAgent): Agent for revising stories.
             grammar_checker (LlmAgent): Agent for checking grammar.
             tone_checker (LlmAgent): Agent for checking tone.
+            min_critique_words (int): Stories shorter than this many words skip the critique and revise loop.
 
         """
         # create internal agents before calling super().__init__()
@@ -84,6 +99,7 @@ class StoryFlowAgent(BaseAgent):
             tone_checker=tone_checker,
             loop_agent=loop_agent,
             sequential_agent=sequential_agent,
+            min_critique_words=min_critique_words,
             sub_agents=sub_agents,
             )
         
@@ -94,49 +110,54 @@ class StoryFlowAgent(BaseAgent):
         Uses the instance attributes assigned by Pydantic (e.g., self.story_generator).
         """
 
-        logger.info(f"[{self.name}] Starting story generation workflow.")
+        async with self._invoke_locks.hold(ctx.session.id):
+            logger.info(f"[{self.name}] Starting story generation workflow.")
         
-        # Step 1: Generate an initial story using the story_generator agent
-        async for event in self.story_generator.run_async(ctx):
-            yield event
+            # Step 1: Generate an initial story using the story_generator agent
+            async for event in self.story_generator.run_async(ctx):
+                yield event
 
-        if "current_story" not in ctx.session.state or not ctx.session.state["current_story"]:
-            logger.error("No story generated.")
-            return # stop if initial story generation fails
+            if "current_story" not in ctx.session.state or not ctx.session.state["current_story"]:
+                logger.error("No story generated.")
+                return # stop if initial story generation fails
         
-        logger.info(f"[{self.name}] Generated story: {ctx.session.state['current_story']}")
-
-        # Step 2: Critique the story using the critic agent
-        async for event in self.loop_agent.run_async(ctx):
-            yield event
-        logger.info(f"[{self.name}] Critique and revise completed.")
-
-        # step 3: Check grammar and tone using the sequential agent
-        async for event in self.sequential_agent.run_async(ctx):
-            yield event
-        logger.info(f"[{self.name}] Grammar and tone check completed.")
+            logger.info(f"[{self.name}] Generated story: {ctx.session.state['current_story']}")
+
+            # Step 2: Critique the story using the critic agent, unless it is too short to be worth it
+            story_words = len(ctx.session.state["current_story"].split())
+            if story_words < self.min_critique_words:
+                logger.info(f"[{self.name}] Story has {story_words} words (< {self.min_critique_words}). Skipping critique and revise.")
+            else:
+                async for event in self.loop_agent.run_async(ctx):
+                    yield event
+                logger.info(f"[{self.name}] Critique and revise completed.")
+
+            # step 3: Check grammar and tone using the sequential agent
+            async for event in self.sequential_agent.run_async(ctx):
+                yield event
+            logger.info(f"[{self.name}] Grammar and tone check completed.")
 
-        # Step 4: Check if the tone is negative and regenerate the story if needed
-        tone = ctx.session.state.get("tone_check_result")
+            # Step 4: Check if the tone is negative and regenerate the story if needed
+            tone = ctx.session.state.get("tone_check_result")
 
-        if tone == "negative":
-            logger.info(f"[{self.name}] Tone is negative. Regenerating story.")
-            async for event in self.story_generator.run_async(ctx):
-                yield event
-            logger.info(f"[{self.name}] Regenerated story: {ctx.session.state['current_story']}")
+            if tone == "negative":
+                logger.info(f"[{self.name}] Tone is negative. Regenerating story.")
+                async for event in self.story_generator.run_async(ctx):
+                    yield event
+                logger.info(f"[{self.name}] Regenerated story: {ctx.session.state['current_story']}")
         
-        else:
-            logger.info(f"[{self.name}] Tone is positive. No need to regenerate the story.")
-            pass
+            else:
+                logger.info(f"[{self.name}] Tone is positive. No need to regenerate the story.")
+                pass
 
-        logger.info(f"[{self.name}] Story generation workflow completed.")
+            logger.info(f"[{self.name}] Story generation workflow completed.")
 
 
 # --- Define individual LLM agents ---
 
 # Story generation agent
 story_generator = LlmAgent(
-    model=model_name, 
+    model=get_model(model_name), 
     name="story_generator",
     description="Generates a story based on the given prompt.",
     instruction = """
@@ -147,7 +168,7 @@ story_generator = LlmAgent(
 )
 
 critic = LlmAgent(
-    model=model_name, 
+    model=get_model(model_name), 
     name="critic",
     description="Critiques the story for errors and improvements.",
     instruction = """
@@ -160,7 +181,7 @@ critic = LlmAgent(
 )
 
 reviser = LlmAgent(
-    model=model_name, 
+    model=get_model(model_name), 
     name="reviser",
     description="Revises the story based on the critique.",
     instruction = """
@@ -172,7 +193,7 @@ reviser = LlmAgent(
 )
 
 grammar_checker = LlmAgent(
-    model=model_name, 
+    model=get_model(model_name), 
     name="grammar_checker",
     description="Checks the grammar of the story.",
     instruction = """
@@ -184,7 +205,7 @@ grammar_checker = LlmAgent(
 )
 
 tone_checker = LlmAgent(
-    model=model_name, 
+    model=get_model(model_name), 
     name="tone_checker",
     description="Checks the tone of the story.",
     instruction = """
@@ -206,7 +227,7 @@ root_agent = StoryFlowAgent(
 )
 
 initial_state = {"topic": "a brave kitten exploring a haunted house"}
-session = session_service.create_session(
+_SESSION = session_service.create_session(
     app_name=APP_NAME, 
     user_id=USER_ID, 
     session_id=SESSION_ID,
@@ -215,9 +236,13 @@ session = session_service.create_session(
 runner = Runner(
     app_name=APP_NAME, 
     agent=root_agent, 
-    session_service=session,
+    session_service=session_service,
 )
 
+def get_session():
+    """Returns the session handle created at import, instead of looking it up on every call."""
+    return _SESSION
+
 def call_agent(story_topic:str):
     """
     Call the agent with a story topic.
@@ -225,12 +250,13 @@ def call_agent(story_topic:str):
         story_topic (str): The topic for the story to be generated.
     """
 
-    current_session = session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
-    if not current_session:
-        logger.error("Session not found!")
-        return
+    current_session = get_session()
 
-    current_session.state["topic"] = story_topic
+    # session services hand out copies, so state is changed through an event rather than by mutating the handle
+    session_service.append_event(
+        current_session,
+        Event(author="user", actions=EventActions(state_delta={"topic": story_topic})),
+    )
     logger.info(f"Updated session state topic to: {story_topic}")
 
     content = types.Content(role="user", parts=[types.Part(text = f"Generate a story about: {story_topic}")])
@@ -252,6 +278,7 @@ def call_agent(story_topic:str):
             finally_response_content = event.content.parts[0].text
             break
     
+    # the runner works on its own copy of the session, so the final state has to be read back from the service
     final_session = session_service.get_session(app_name=APP_NAME, 
                                                 user_id=USER_ID, 
                                                 session_id=SESSION_ID)
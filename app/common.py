@@ -0,0 +1,314 @@
+import asyncio
+import collections
+import contextlib
+import functools
+import logging
+import sys
+import sysconfig
+import threading
+import time
+import weakref
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Coroutine, Optional, TypeVar
+
+from google.adk.models import Gemini
+from google.genai import Client, types
+
+
+# --- Configure Logging ---
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# genai clients keep an async connection pool tied to the loop that opened it, so one client is kept per loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Client]" = weakref.WeakKeyDictionary()
+_loopless_client: Optional[Client] = None
+_clients_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def configure_event_loop():
+    """
+    Install the fastest available asyncio event loop policy, once per process.
+
+    uvloop is used on Unix when it is installed. Windows gets the proactor loop, and free-threaded
+    Python builds (which uvloop does not support) or a missing uvloop keep the stdlib default.
+    The policy only affects loops created afterwards, so call this before asyncio.run().
+    """
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+        logger.info("Using WindowsProactorEventLoopPolicy.")
+        return
+
+    if sysconfig.get_config_var("Py_GIL_DISABLED"):
+        asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+        logger.info("Free-threaded Python detected, using the default event loop policy.")
+        return
+
+    try:
+        import uvloop
+    except ImportError:
+        logger.info("uvloop is not installed, using the default event loop policy.")
+        return
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info("Using uvloop event loop policy.")
+
+
+def _get_client(headers: dict[str, str]) -> Client:
+    """Returns the genai Client shared by every agent running on the current event loop."""
+    global _loopless_client
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    with _clients_lock:
+        client = _clients.get(loop) if loop is not None else _loopless_client
+        if client is None:
+            client = Client(http_options=types.HttpOptions(headers=headers))
+            if loop is not None:
+                _clients[loop] = client
+            else:
+                _loopless_client = client
+        return client
+
+
+class SharedGemini(Gemini):
+    """
+    Gemini model that reuses one genai Client, and so one connection pool, per event loop.
+
+    ADK builds a new Gemini, with a new Client, on every call when an LlmAgent is given a model name,
+    so agents should be given get_model(model_name) instead.
+    """
+
+    @property
+    def api_client(self) -> Client:
+        return _get_client(self._tracking_headers)
+
+
+@functools.lru_cache(maxsize=None)
+def get_model(model_name: str) -> SharedGemini:
+    """
+    Returns the model instance shared by every agent using model_name.
+    Args:
+        model_name (str): The Gemini model name, e.g. "gemini-2.0-flash".
+    Returns:
+        SharedGemini: The shared model.
+    """
+    return SharedGemini(model=model_name)
+
+
+@contextlib.asynccontextmanager
+async def hold_lock(lock: threading.Lock) -> AsyncIterator[None]:
+    """
+    Hold a threading.Lock from a coroutine without blocking the event loop.
+    Unlike an asyncio.Lock, it serializes coroutines running on different loops and threads,
+    e.g. concurrent Runner.run calls, which each start their own loop.
+    Args:
+        lock (threading.Lock): The lock to hold for the duration of the block.
+    """
+    if not lock.acquire(blocking=False):
+        acquiring = asyncio.get_running_loop().run_in_executor(None, lock.acquire)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # the worker thread still takes the lock, so it is released as soon as it does
+            acquiring.add_done_callback(lambda _: lock.release())
+            raise
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+class SessionLocks:
+    """
+    Registry of the locks serializing agent runs per session, held through hold_lock.
+    Entries are weak, so a session's lock is dropped once no run holds or waits for it,
+    and one-off sessions (e.g. one per batch topic) do not accumulate.
+    """
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+        self._guard = threading.Lock()
+
+    def get(self, session_id: str) -> threading.Lock:
+        """Returns the lock of the given session, creating it if no run is using one."""
+        with self._guard:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = threading.Lock()
+            return lock
+
+    def hold(self, session_id: str):
+        """Returns an async context manager holding the lock of the given session."""
+        return hold_lock(self.get(session_id))
+
+
+class _StreamError:
+    """Carries an exception raised by a merged stream to the consumer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_STREAM_DONE = object()
+
+
+async def pump_events(*streams: AsyncGenerator[Any, None]) -> AsyncGenerator[Any, None]:
+    """
+    Run several async generators as producer tasks and yield their items in order of arrival.
+
+    A producer waits until each of its items has been handled by the consumer before pulling the next one,
+    so a sub-agent never runs ahead of the runner that applies its events to the session, and at most
+    one item per stream is ever waiting. A single stream needs none of this: iterating an async
+    generator directly already gives the same backpressure.
+    The first exception raised by a stream is re-raised to the caller, and the remaining tasks are
+    cancelled when this generator is closed.
+    Args:
+        *streams (AsyncGenerator): The generators to run, e.g. sub_agent.run_async(ctx).
+    Yields:
+        Any: The items produced by the streams.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+
+    async def _pump(stream: AsyncGenerator[Any, None]):
+        try:
+            async for item in stream:
+                consumed = loop.create_future()
+                await queue.put((item, consumed))
+                await consumed
+        except Exception as error:
+            await queue.put((_StreamError(error), None))
+        else:
+            await queue.put((_STREAM_DONE, None))
+        finally:
+            # close the generator in the task and context that iterated it, not later from the garbage collector
+            await stream.aclose()
+
+    tasks = [asyncio.create_task(_pump(stream)) for stream in streams]
+    pending = len(tasks)
+    try:
+        while pending:
+            item, consumed = await queue.get()
+            if item is _STREAM_DONE:
+                pending -= 1
+            elif isinstance(item, _StreamError):
+                raise item.error
+            else:
+                yield item
+                consumed.set_result(None)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _run_in_new_thread(coro: Coroutine[Any, Any, T]) -> T:
+    """Run the coroutine on a fresh event loop in a worker thread and wait for the result."""
+    result: dict[str, Any] = {}
+
+    def _worker():
+        loop = asyncio.new_event_loop()
+        try:
+            result["value"] = loop.run_until_complete(coro)
+        except BaseException as error:
+            result["error"] = error
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=_worker, daemon=True)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine to completion from synchronous code, whether or not an event loop is running.
+
+    1. Inside a running loop, nest_asyncio (if installed) re-enters that loop.
+    2. Inside a running loop without nest_asyncio, or one it cannot patch (e.g. uvloop),
+       the coroutine runs on a new loop in a worker thread.
+    3. Without a running loop, asyncio.run() is used.
+    Args:
+        coro (Coroutine): The coroutine to run.
+    Returns:
+        The value returned by the coroutine.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    try:
+        import nest_asyncio
+        nest_asyncio.apply(loop)
+    except (ImportError, ValueError):
+        return _run_in_new_thread(coro)
+    return loop.run_until_complete(coro)
+
+
+class BatchProcessor:
+    """
+    Runs an async worker over many items with bounded concurrency and a start rate limit.
+    """
+
+    def __init__(self,
+        max_concurrency: int = 10,
+        rate_limit: int = 100,
+        period: float = 60.0,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        ):
+        """
+        Initialize the BatchProcessor.
+        Args:
+            max_concurrency (int): Maximum number of items processed at the same time.
+            rate_limit (int): Maximum number of items started per period.
+            period (float): Length of the rate limit window in seconds.
+            progress_callback (Optional[Callable[[int, int], None]]): Called with (done, total) after each item.
+        """
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.period = period
+        self.progress_callback = progress_callback
+
+    async def run(self, items: list, worker: Callable[[Any], Awaitable[T]]) -> list:
+        """
+        Process every item with the worker.
+        Args:
+            items (list): The items to process.
+            worker (Callable): Coroutine function called with each item.
+        Returns:
+            list: The worker results in the order of items; an item whose worker raised holds the exception.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        rate_lock = asyncio.Lock()
+        started: collections.deque = collections.deque()
+        done = 0
+
+        async def _wait_for_rate_slot():
+            async with rate_lock:
+                if len(started) >= self.rate_limit:
+                    await asyncio.sleep(max(0.0, started[0] + self.period - time.monotonic()))
+                    started.popleft()
+                started.append(time.monotonic())
+
+        async def _process(item):
+            nonlocal done
+            async with semaphore:
+                await _wait_for_rate_slot()
+                try:
+                    return await worker(item)
+                except Exception as error:
+                    logger.error(f"Batch item {item!r} failed: {error}")
+                    return error
+                finally:
+                    done += 1
+                    if self.progress_callback is not None:
+                        self.progress_callback(done, len(items))
+
+        return await asyncio.gather(*(_process(item) for item in items))
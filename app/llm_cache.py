@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Optional, Protocol
+
+from semantic_cache import SemanticCache
+
+
+# --- Configure Logging ---
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(Protocol):
+    """Storage used by LLMCache for exact-match responses."""
+
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    def set(self, key: str, value: str):
+        ...
+
+
+class InMemoryBackend:
+    """
+    Dictionary backed CacheBackend with a time to live per entry.
+    """
+
+    def __init__(self, ttl_seconds: Optional[float] = 3600):
+        """
+        Initialize the InMemoryBackend.
+        Args:
+            ttl_seconds (Optional[float]): Seconds an entry stays valid. None keeps entries forever.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.backend: dict[str, str] = {}
+        self._stored_at: dict[str, float] = {}
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        if self.ttl_seconds is not None and time.monotonic() - self._stored_at[key] > self.ttl_seconds:
+            del self.backend[key]
+            del self._stored_at[key]
+            return None
+        return value
+
+    def set(self, key: str, value: str):
+        self.backend[key] = value
+        self._stored_at[key] = time.monotonic()
+
+
+class LLMCache:
+    """
+    Two layer response cache for agent pipelines.
+
+    Layer 1 is an exact match on sha256 of the model name and the query.
+    Layer 2 is an optional SemanticCache consulted only when layer 1 misses. Its query embeddings
+    are memoized on the raw text, so a repeated query is never embedded twice.
+    """
+
+    def __init__(self,
+        backend: Optional[CacheBackend] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        ):
+        """
+        Initialize the LLMCache.
+        Args:
+            backend (Optional[CacheBackend]): Exact-match storage. Defaults to an InMemoryBackend.
+            semantic_cache (Optional[SemanticCache]): Similarity based fallback layer.
+        """
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.semantic_cache = semantic_cache
+
+    @staticmethod
+    def make_key(model_name: str, query: str) -> str:
+        payload = json.dumps({"model": model_name, "q": query}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, model_name: str, query: str) -> Optional[str]:
+        """
+        Look up a cached response for the query.
+        Args:
+            model_name (str): The model the response was generated with.
+            query (str): The user query.
+        Returns:
+            Optional[str]: The cached response, or None on a miss in every layer.
+        """
+        response = self.backend.get(self.make_key(model_name, query))
+        if response is not None:
+            logger.info("Exact cache hit.")
+            return response
+
+        if self.semantic_cache is not None:
+            response = self.semantic_cache.lookup(self.semantic_cache.embed(query))
+            if response is not None:
+                # promote to layer 1 so the next identical query skips the embedding
+                self.backend.set(self.make_key(model_name, query), response)
+        return response
+
+    def set(self, model_name: str, query: str, response: str):
+        """
+        Store a response in every layer.
+        Args:
+            model_name (str): The model the response was generated with.
+            query (str): The user query.
+            response (str): The response to cache.
+        """
+        self.backend.set(self.make_key(model_name, query), response)
+        if self.semantic_cache is not None:
+            self.semantic_cache.insert(self.semantic_cache.embed(query), response)
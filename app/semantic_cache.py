@@ -0,0 +1,405 @@
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+try:
+    import faiss
+except ImportError:  # faiss is optional, lookups fall back to a numpy scan
+    faiss = None
+
+njit = None
+if faiss is None:
+    # the int8 scan only runs without faiss, so numba is not imported or compiled otherwise
+    try:
+        from numba import njit, prange
+    except ImportError:  # numba is optional, the scan then runs in numpy
+        pass
+
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+
+# above this many entries the flat FAISS index is replaced by a trained IVF index
+IVF_THRESHOLD = 50_000
+IVF_NLIST = 256
+IVF_NPROBE = 8
+
+# --- Configure Logging ---
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoder(model_name: str) -> SentenceTransformer:
+    logger.info(f"Loading embedding model: {model_name}")
+    return SentenceTransformer(model_name)
+
+
+@functools.lru_cache(maxsize=4096)
+def _embed(model_name: str, text: str) -> np.ndarray:
+    # memoized on the raw text so repeated prompts skip the model forward pass; the shared array is read-only
+    embedding = np.asarray(_get_encoder(model_name).encode(text, normalize_embeddings=True), dtype=np.float32)
+    embedding.setflags(write=False)
+    return embedding
+
+
+def quantize(embedding: np.ndarray) -> tuple[np.ndarray, np.float32]:
+    """
+    Quantize an embedding to int8 with a per-vector scale.
+    Args:
+        embedding (np.ndarray): float32 embedding.
+    Returns:
+        tuple[np.ndarray, np.float32]: The int8 codes and the scale, so that embedding ~= codes * scale.
+    """
+    peak = float(np.max(np.abs(embedding)))
+    scale = np.float32(peak / 127 if peak > 0 else 1.0)
+    codes = np.round(embedding / scale).astype(np.int8)
+    return codes, scale
+
+
+def _topk_cosine_numpy(codes: np.ndarray, scales: np.ndarray, q_codes: np.ndarray, q_scale: float, k: int):
+    """
+    Score int8 quantized embeddings against a quantized query and return the k best matches.
+    Args:
+        codes (np.ndarray): int8 matrix of quantized normalized embeddings, one per row.
+        scales (np.ndarray): float32 scale of each row.
+        q_codes (np.ndarray): int8 quantized normalized query embedding.
+        q_scale (float): Scale of the query.
+        k (int): Number of matches to return.
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The k best cosine similarities and their row indices, best first.
+    """
+    # int8 products are accumulated in int32, then rescaled to the float cosine similarity
+    scores = (codes.astype(np.int32) @ q_codes.astype(np.int32)) * (scales * np.float32(q_scale))
+    idx = np.argsort(-scores)[:k]
+    return scores[idx], idx
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _topk_cosine_jit(codes, scales, q_codes, q_scale, k):
+        # same contract as _topk_cosine_numpy, with the row scan spread across cores
+        n, d = codes.shape
+        scores = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            acc = np.int32(0)
+            for j in range(d):
+                acc += np.int32(codes[i, j]) * np.int32(q_codes[j])
+            scores[i] = acc * scales[i] * q_scale
+        idx = np.argsort(-scores)[:k]
+        return scores[idx], idx
+
+    topk_cosine = _topk_cosine_jit
+    # compile at import so the first lookup does not pay the JIT cost
+    topk_cosine(
+        np.zeros((2, EMBEDDING_DIM), dtype=np.int8), np.ones(2, dtype=np.float32),
+        np.zeros(EMBEDDING_DIM, dtype=np.int8), np.float32(1.0), 1,
+    )
+else:
+    topk_cosine = _topk_cosine_numpy
+
+
+@contextlib.contextmanager
+def _atomic_open(path: str, mode: str):
+    # write next to the target and swap it in, so an interrupted save never leaves a truncated file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode) as f:
+        yield f
+    os.replace(tmp_path, path)
+
+
+class SemanticCache:
+    """
+    In-memory cache of agent answers keyed on the meaning of the query.
+
+    Queries are embedded locally with a sentence-transformers model and compared by cosine
+    similarity against the cached queries. When the best match is above the threshold, the
+    stored answer is returned and the LLM round-trip is skipped.
+    Least recently used entries are evicted once the cache holds max_entries answers.
+
+    Embeddings are stored as int8 codes with a float32 scale per entry (384 B instead of 1536 B).
+    When faiss is installed, lookups go through an 8-bit scalar quantized inner product index
+    (flat, then IVF past IVF_THRESHOLD entries) whose ids are the cache slots; otherwise the
+    int8 matrix is scanned.
+
+    With persist_path set, the cache is saved at most every save_interval seconds and at interpreter exit,
+    each file written atomically, and entries older than ttl_seconds are neither served nor reloaded.
+
+    A second cache can be given as a long-term tier: entries hit promote_after times are copied into it,
+    and it answers lookups that miss here, so frequently used answers outlive LRU eviction.
+    """
+
+    def __init__(self,
+        threshold: float = 0.92,
+        max_entries: int = 1024,
+        model_name: str = EMBEDDING_MODEL,
+        persist_path: Optional[str] = None,
+        long_term: Optional["SemanticCache"] = None,
+        promote_after: int = 3,
+        ttl_seconds: Optional[float] = None,
+        save_interval: float = 60.0,
+        ):
+        """
+        Initialize the SemanticCache.
+        Args:
+            threshold (float): Minimum cosine similarity for a cached answer to be reused.
+            max_entries (int): Number of answers kept before the least recently used one is evicted.
+            model_name (str): sentence-transformers model used to embed the queries.
+            persist_path (Optional[str]): Path of the FAISS index file. When set, the cache is loaded from
+                it on start and saved periodically, with the embeddings and answers stored next to it.
+            long_term (Optional[SemanticCache]): Long-term tier for frequently hit entries.
+            promote_after (int): Number of hits after which an entry is copied to the long-term tier.
+            ttl_seconds (Optional[float]): Seconds an answer stays valid. None keeps answers until evicted.
+            save_interval (float): Minimum seconds between two saves triggered by inserts.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.model_name = model_name
+        self.persist_path = persist_path
+        self.long_term = long_term
+        self.promote_after = promote_after
+        self.ttl_seconds = ttl_seconds
+        self.save_interval = save_interval
+
+        self._codes = np.zeros((max_entries, EMBEDDING_DIM), dtype=np.int8)
+        self._scales = np.ones(max_entries, dtype=np.float32)
+        self._answers: list[str] = []
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._hits = np.zeros(max_entries, dtype=np.int64)
+        # wall clock insertion times, so the TTL holds across restarts
+        self._stored_at = np.zeros(max_entries, dtype=np.float64)
+        self._clock = 0
+        self._index = None
+        self._dirty = False
+        self._last_saved = time.monotonic()
+        # agents call into the cache from worker threads, so reads and writes of the arrays and index are serialized
+        self._lock = threading.RLock()
+
+        if persist_path and os.path.exists(self._answers_path) and os.path.exists(self._embeddings_path):
+            self.load()
+        else:
+            self._rebuild_index()
+        if persist_path:
+            atexit.register(self._save_if_dirty)
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Embed the given text into a L2 normalized vector.
+        Args:
+            text (str): The text to embed.
+        Returns:
+            np.ndarray: The float32 embedding of shape (EMBEDDING_DIM,).
+        """
+        return _embed(self.model_name, text)
+
+    def lookup(self, embedding: np.ndarray) -> Optional[str]:
+        """
+        Find a cached answer for a query embedding.
+        Args:
+            embedding (np.ndarray): The normalized embedding of the query.
+        Returns:
+            Optional[str]: The cached answer, or None if no cached query is similar enough.
+        """
+        with self._lock:
+            slot = self._find(embedding)
+            if slot is None:
+                return self.long_term.lookup(embedding) if self.long_term is not None else None
+
+            self._touch(slot)
+            self._hits[slot] += 1
+            if self.long_term is not None and self._hits[slot] == self.promote_after:
+                logger.info(f"Promoting cached answer after {self.promote_after} hits to the long-term tier.")
+                self.long_term.insert(self._codes[slot].astype(np.float32) * self._scales[slot], self._answers[slot])
+            return self._answers[slot]
+
+    def contains(self, embedding: np.ndarray) -> bool:
+        """
+        Check whether a query embedding has a cached answer in this cache or its long-term tier.
+        Unlike lookup, this does not count as a hit, so LRU order and promotion are left untouched.
+        Args:
+            embedding (np.ndarray): The normalized embedding of the query.
+        Returns:
+            bool: True if a cached query is similar enough.
+        """
+        with self._lock:
+            if self._find(embedding) is not None:
+                return True
+            return self.long_term is not None and self.long_term.contains(embedding)
+
+    def _find(self, embedding: np.ndarray) -> Optional[int]:
+        size = len(self._answers)
+        if size == 0:
+            return None
+
+        if self._index is not None:
+            scores, slots = self._index.search(embedding.reshape(1, -1), 1)
+            best, best_score = int(slots[0][0]), float(scores[0][0])
+            if best < 0:
+                return None
+        else:
+            # embeddings are normalized, so the dot product is the cosine similarity
+            q_codes, q_scale = quantize(embedding)
+            scores, slots = topk_cosine(self._codes[:size], self._scales[:size], q_codes, q_scale, 1)
+            best, best_score = int(slots[0]), float(scores[0])
+
+        if best_score < self.threshold:
+            return None
+        if self.ttl_seconds is not None and time.time() - self._stored_at[best] > self.ttl_seconds:
+            return None
+
+        logger.info(f"Semantic cache hit with similarity {best_score:.3f}")
+        return best
+
+    def insert(self, embedding: np.ndarray, answer: str):
+        """
+        Store an answer for a query embedding, evicting the least recently used entry if full.
+        Args:
+            embedding (np.ndarray): The normalized embedding of the query.
+            answer (str): The answer to cache.
+        """
+        with self._lock:
+            size = len(self._answers)
+            if size < self.max_entries:
+                slot = size
+                self._answers.append(answer)
+            else:
+                slot = int(np.argmin(self._last_used))
+                self._answers[slot] = answer
+
+            self._codes[slot], self._scales[slot] = quantize(embedding)
+            self._hits[slot] = 0
+            self._stored_at[slot] = time.time()
+            self._touch(slot)
+
+            if self._index is not None:
+                if slot < size:
+                    self._index.remove_ids(np.array([slot], dtype=np.int64))
+                if size < IVF_THRESHOLD <= len(self._answers):
+                    self._rebuild_index()
+                else:
+                    self._index.add_with_ids(embedding.reshape(1, -1), np.array([slot], dtype=np.int64))
+
+            if self.persist_path:
+                self._dirty = True
+                if time.monotonic() - self._last_saved >= self.save_interval:
+                    self.save()
+
+    def save(self):
+        """Write the FAISS index, embeddings and answers to persist_path, each file replaced atomically."""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+            size = len(self._answers)
+            with _atomic_open(self._embeddings_path, "wb") as f:
+                np.savez(f, codes=self._codes[:size], scales=self._scales[:size])
+            with _atomic_open(self._answers_path, "w") as f:
+                json.dump({
+                    "answers": self._answers,
+                    "last_used": self._last_used[:size].tolist(),
+                    "stored_at": self._stored_at[:size].tolist(),
+                }, f)
+            if self._index is not None:
+                tmp_path = self.persist_path + ".tmp"
+                faiss.write_index(self._index, tmp_path)
+                os.replace(tmp_path, self.persist_path)
+            self._dirty = False
+            self._last_saved = time.monotonic()
+
+    def load(self):
+        """Restore the cache saved at persist_path. Unreadable or inconsistent files are logged and the cache starts empty."""
+        try:
+            self._load()
+        except Exception as error:
+            logger.warning(f"Could not load the semantic cache from {self.persist_path}, starting empty: {error}")
+            self._answers = []
+            self._last_used[:] = 0
+            self._hits[:] = 0
+            self._clock = 0
+            self._rebuild_index()
+
+    def _load(self):
+        with open(self._answers_path) as f:
+            saved = json.load(f)
+        with np.load(self._embeddings_path) as saved_embeddings:
+            codes, scales = saved_embeddings["codes"], saved_embeddings["scales"]
+        answers = saved["answers"]
+        last_used = np.asarray(saved["last_used"], dtype=np.int64)
+        stored_at = np.asarray(saved.get("stored_at", [time.time()] * len(answers)), dtype=np.float64)
+        if not len(answers) == len(codes) == len(scales) == len(last_used) == len(stored_at):
+            raise ValueError("the saved embeddings and answers have different sizes")
+
+        keep = np.arange(len(answers))
+        if self.ttl_seconds is not None:
+            keep = keep[time.time() - stored_at <= self.ttl_seconds]
+        keep = keep[:self.max_entries]
+        size = len(keep)
+
+        self._answers = [answers[i] for i in keep]
+        self._codes[:size] = codes[keep]
+        self._scales[:size] = scales[keep]
+        self._last_used[:size] = last_used[keep]
+        self._stored_at[:size] = stored_at[keep]
+        self._clock = int(self._last_used.max(initial=0))
+
+        # the saved index is only reusable when every saved entry was kept in place
+        if size == len(answers) and faiss is not None and os.path.exists(self.persist_path):
+            self._index = faiss.read_index(self.persist_path)
+            if self._index.ntotal == size:
+                logger.info(f"Loaded {size} cached answers from {self.persist_path}")
+                return
+        self._rebuild_index()
+        logger.info(f"Loaded {size} cached answers from {self._answers_path}")
+
+    def _save_if_dirty(self):
+        if self._dirty:
+            self.save()
+
+    @property
+    def _embeddings_path(self) -> str:
+        return os.path.splitext(self.persist_path)[0] + ".npz"
+
+    @property
+    def _answers_path(self) -> str:
+        return os.path.splitext(self.persist_path)[0] + ".json"
+
+    def _rebuild_index(self):
+        if faiss is None:
+            return
+
+        size = len(self._answers)
+        embeddings = self._dequantize(size)
+        if size >= IVF_THRESHOLD:
+            quantizer = faiss.IndexFlatIP(EMBEDDING_DIM)
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, EMBEDDING_DIM, IVF_NLIST, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT,
+            )
+            # quantize the embeddings themselves rather than centroid residuals, so ranges hold for new entries
+            index.by_residual = False
+            index.train(embeddings)
+            index.nprobe = IVF_NPROBE
+        else:
+            flat = faiss.IndexScalarQuantizer(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            # normalized embeddings lie in [-1, 1], so the 8-bit ranges are fixed rather than learned
+            flat.train(np.stack([-np.ones(EMBEDDING_DIM), np.ones(EMBEDDING_DIM)]).astype(np.float32))
+            index = faiss.IndexIDMap2(flat)
+
+        if size:
+            index.add_with_ids(embeddings, np.arange(size, dtype=np.int64))
+        self._index = index
+
+    def _dequantize(self, size: int) -> np.ndarray:
+        return self._codes[:size].astype(np.float32) * self._scales[:size, None]
+
+    def _touch(self, slot: int):
+        self._clock += 1
+        self._last_used[slot] = self._clock